@@ -1,21 +1,17 @@
 ﻿# app.py
-# English-to-SQL Translator (NLTK) â€” Restaurant / CafÃ© Edition
+# English-to-SQL Translator â€” Restaurant / CafÃ© Edition
 # Supports: monthly / quarterly / yearly, "January 2025", "Q4 2025", "in 2024", and explicit date between
 # Works with SQLite (default) or PostgreSQL
 
 import os
 import re
-import calendar
-from functools import lru_cache
+import time
+from uuid import uuid4
 from datetime import date
 
 import streamlit as st
 import pandas as pd
 
-# NLP
-import nltk
-from nltk import word_tokenize, pos_tag
-
 # Database
 import sqlite3
 
@@ -23,39 +19,28 @@ import sqlite3
 try:
     import psycopg2  # noqa: F401
     import psycopg2.extras  # noqa: F401
+    import psycopg2.extensions  # noqa: F401
 except Exception:
     psycopg2 = None  # sentinel so we can check later
 
-# ========= NLTK setup =========
-@lru_cache(maxsize=1)
-def _download_nltk():
-    try:
-        nltk.data.find("tokenizers/punkt")
-    except LookupError:
-        nltk.download("punkt", quiet=True)
-    # Older tagger name still commonly used; if this errors you can switch to 'averaged_perceptron_tagger_eng'
-    try:
-        nltk.data.find("taggers/averaged_perceptron_tagger")
-    except LookupError:
-        nltk.download("averaged_perceptron_tagger", quiet=True)
-
-_download_nltk()
+# ========= Tokenizer =========
+# Downstream only ever looks at lowercase word tokens (no POS tags), so a
+# precompiled regex is all we need here. Dotted identifiers such as
+# customers.customer_name stay one token (as with word_tokenize), so a column in a
+# WHERE tail doesn't trigger the customer/product/category dimension dispatch.
+_TOKEN_RE = re.compile(r"[a-z0-9_]+(?:\.[a-z0-9_]+)*")
 
 
 def tokenize_and_tag(q: str):
-    try:
-        tokens = word_tokenize(q.lower())
-        tagged = pos_tag(tokens)
-        return tokens, tagged
-    except LookupError:
-        tokens = q.lower().split()
-        tagged = [(t, "NN") for t in tokens]
-        return tokens, tagged
+    tokens = _TOKEN_RE.findall(q.lower())
+    return tokens, None
 
 
 # ========= Page =========
 st.set_page_config(page_title="Cafe BI: English to SQL", layout="wide")
-st.markdown("""
+
+# All page styling in one block, emitted once per run
+APP_CSS = """
 <style>
 /* --- Buttons: keep your blue palette --- */
 
@@ -159,12 +144,8 @@ div[data-testid="stSidebar"] .stButton > button:disabled {
   line-height: 1;
 }
 </style>
-""", unsafe_allow_html=True)
-
-# Minimal styling: blue buttons + a nicer helper when disconnected
-st.markdown("""
-<style>\n/\*\ ---\ Unified\ Button\ Styling\ \(Main\ \+\ Sidebar\)\ ---\ \*/\n\.stButton\ >\ button,\ndiv\[data-testid="stSidebar"]\ \.stButton\ >\ button\ \{\n\ \ background:\ \#B9D9EB\ !important;\ \ \ \ /\*\ light\ blue\ \*/\n\ \ color:\ \#1f2937\ !important;\ \ \ \ \ \ \ \ \ \ /\*\ dark\ text\ \*/\n\ \ border:\ none\ !important;\n\ \ border-radius:\ 10px\ !important;\n\ \ padding:\ 8px\ 16px\ !important;\n\ \ font-weight:\ 700\ !important;\n\ \ box-shadow:\ none\ !important;\n\ \ transition:\ background-color\ 120ms\ ease,\ color\ 120ms\ ease\ !important;\n}\n/\*\ Hover\ =\ darker\ background\ \+\ light\ text\ \*/\n\.stButton\ >\ button:hover,\ndiv\[data-testid="stSidebar"]\ \.stButton\ >\ button:hover\ \{\n\ \ background:\ \#4B9CD3\ !important;\ \ \ \ \ /\*\ darker\ blue\ \*/\n\ \ color:\ \#FFFFFF\ !important;\ \ \ \ \ \ \ \ \ \ \ /\*\ light\ text\ \*/\n}\n/\*\ Active/Pressed/Focus\ =\ same\ darker\ background\ \+\ light\ text\ \(no\ red\ flash\)\ \*/\n\.stButton\ >\ button:active,\n\.stButton\ >\ button:focus,\n\.stButton\ >\ button:focus-visible,\n\.stButton\ >\ button\[aria-pressed="true"],\ndiv\[data-testid="stSidebar"]\ \.stButton\ >\ button:active,\ndiv\[data-testid="stSidebar"]\ \.stButton\ >\ button:focus,\ndiv\[data-testid="stSidebar"]\ \.stButton\ >\ button:focus-visible,\ndiv\[data-testid="stSidebar"]\ \.stButton\ >\ button\[aria-pressed="true"]\ \{\n\ \ background:\ \#3A88C5\ !important;\ \ \ \ \ /\*\ slightly\ darker\ than\ hover\ for\ pressed\ \*/\n\ \ color:\ \#FFFFFF\ !important;\ \ \ \ \ \ \ \ \ \ \ /\*\ keep\ text\ light\ \*/\n\ \ outline:\ none\ !important;\n\ \ box-shadow:\ none\ !important;\n}\n/\*\ Disabled\ state\ \*/\n\.stButton\ >\ button:disabled,\ndiv\[data-testid="stSidebar"]\ \.stButton\ >\ button:disabled\ \{\n\ \ background:\ \#E5F0F8\ !important;\ \ \ \ \ /\*\ pale\ blue\ \*/\n\ \ color:\ \#9CA3AF\ !important;\ \ \ \ \ \ \ \ \ \ /\*\ gray\ text\ \*/\n\ \ opacity:\ 1\ !important;\n}\n</style>
-""", unsafe_allow_html=True)
+"""
+st.markdown(APP_CSS, unsafe_allow_html=True)
 
 st.title("🥤English-to-SQL Translator — Restaurant / Café Edition")
 st.markdown(
@@ -194,6 +175,16 @@ connect_btn = st.sidebar.button("Connect & Scan Schema")
 
 
 # ========= DB helpers =========
+# Per-connection settings (these don't persist in the file). The app only ever
+# reads, so the shared connection is locked to query_only and leans on mmap'd I/O
+# (1 GiB mmap window, 128 MiB page cache).
+SQLITE_CONN_PRAGMAS = """
+PRAGMA query_only=1;
+PRAGMA temp_store=MEMORY;
+PRAGMA mmap_size=1073741824;
+PRAGMA cache_size=-131072;
+"""
+
 def init_sqlite_if_needed(path: str, seed_sql: str = SEED_FILE):
     """Create and seed SQLite database if missing."""
     if not os.path.exists(path):
@@ -206,23 +197,72 @@ def init_sqlite_if_needed(path: str, seed_sql: str = SEED_FILE):
         with open(seed_sql, "r", encoding="utf-8") as f:
             con.executescript(f.read())
         con.commit()
+        con.execute("PRAGMA journal_mode=WAL;")
         con.close()
 
-def get_connection():
+def current_dsn():
+    """Hashable key describing the selected database (used for caching)."""
     if db_type == "SQLite":
-        # Ensure DB exists and is seeded
-        init_sqlite_if_needed(sqlite_path, SEED_FILE)
-        return sqlite3.connect(sqlite_path, check_same_thread=False)
-    else:
-        if psycopg2 is None:
-            # User selected Postgres but driver isn't installed
-            raise RuntimeError(
-                "PostgreSQL selected but psycopg2 is not installed. "
-                "Either add 'psycopg2-binary==2.9.9' to requirements.txt or switch to SQLite."
-            )
-        return psycopg2.connect(
-            host=pg_host, port=int(pg_port), user=pg_user, password=pg_pass, dbname=pg_db
+        return ("SQLite", sqlite_path)
+    return ("PostgreSQL", pg_host, pg_port, pg_user, pg_pass, pg_db)
+
+
+# One shared SQLite handle per file for every session/thread; the workload is
+# short read-only statements, so check_same_thread=False is safe here.
+@st.cache_resource
+def _sqlite_pool(path):
+    # Ensure DB exists and is seeded
+    init_sqlite_if_needed(path, SEED_FILE)
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.executescript(SQLITE_CONN_PRAGMAS)
+    try:
+        conn.execute("SELECT COUNT(*) FROM orders;").fetchone()  # warm the page cache
+    except sqlite3.Error:
+        pass  # not the cafe schema; nothing to warm
+    return conn
+
+
+def _pg_conn_usable(conn):
+    return (not conn.closed and
+            conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_INERROR)
+
+
+# One long-lived Postgres connection per DSN, shared across reruns and sessions.
+# Every query is read-only, so it runs in autocommit: a failed statement can't leave
+# the shared handle stuck in an aborted transaction. Reopened if closed or broken.
+@st.cache_resource(validate=_pg_conn_usable)
+def _pg_connection(host, port, user, password, dbname):
+    if psycopg2 is None:
+        # User selected Postgres but driver isn't installed
+        raise RuntimeError(
+            "PostgreSQL selected but psycopg2 is not installed. "
+            "Either add 'psycopg2-binary==2.9.9' to requirements.txt or switch to SQLite."
         )
+    conn = psycopg2.connect(
+        host=host, port=int(port), user=user, password=password, dbname=dbname
+    )
+    conn.autocommit = True
+    return conn
+
+
+def _open_connection(dsn):
+    if dsn[0] == "SQLite":
+        return _sqlite_pool(dsn[1])
+    return _pg_connection(*dsn[1:])
+
+def get_connection():
+    return _open_connection(current_dsn())
+
+
+# Postgres has no cheap schema_version equivalent, so its cached schema is keyed on
+# a time bucket instead and gets rescanned at most this often
+PG_SCHEMA_TTL = 60
+
+def schema_version(conn):
+    """SQLite bumps PRAGMA schema_version on every DDL change; Postgres uses a TTL bucket."""
+    if db_type == "SQLite":
+        return conn.execute("PRAGMA schema_version;").fetchone()[0]
+    return int(time.time() // PG_SCHEMA_TTL)
 
 
 def get_schema(conn):
@@ -267,6 +307,18 @@ def fetch_min_max_dates(conn):
         return None, None
 
 
+# Introspection results are cached per DSN; schema_ver is part of the key so a
+# DDL change on SQLite invalidates them immediately instead of waiting for the TTL.
+@st.cache_data(ttl=300, show_spinner=False)
+def cached_schema(dsn, schema_ver):
+    return get_schema(_open_connection(dsn))
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def cached_min_max_dates(dsn, schema_ver):
+    return fetch_min_max_dates(_open_connection(dsn))
+
+
 # ========= Session state =========
 init_state = {"schema": None, "conn": None, "prefill": None, "date_min": None, "date_max": None}
 for k, v in init_state.items():
@@ -277,9 +329,12 @@ for k, v in init_state.items():
 # ========= Connect =========
 if connect_btn:
     try:
+        dsn = current_dsn()
         conn = get_connection()
-        schema = get_schema(conn)
-        date_min, date_max = fetch_min_max_dates(conn)
+        ver = schema_version(conn)
+        # Unchanged (dsn, ver) is a cache hit: no PRAGMA table_info / MIN-MAX rescan
+        schema = cached_schema(dsn, ver)
+        date_min, date_max = cached_min_max_dates(dsn, ver)
         st.session_state["conn"] = conn
         st.session_state["schema"] = schema
         st.session_state["date_min"] = date_min
@@ -300,8 +355,11 @@ AGG_KEYWORDS = {
     "average": "AVG", "avg": "AVG", "count": "COUNT", "number": "COUNT",
     "maximum": "MAX", "max": "MAX", "minimum": "MIN", "min": "MIN"
 }
-DISTINCT_WORDS = {"distinct", "unique"}
-TOP_N_RE = re.compile(r"\b(top|best)\s+(\d+)\b")
+DISTINCT_WORDS = frozenset({"distinct", "unique"})
+_CUSTOMER_WORDS = frozenset({"customer", "customers"})
+_PRODUCT_WORDS = frozenset({"product", "products"})
+_CATEGORY_WORDS = frozenset({"category", "categories"})
+Q_TOKEN_RE = re.compile(r"\bq[1-4]\b")
 
 MONTHS = {
     "january": 1, "jan": 1, "february": 2, "feb": 2, "march": 3, "mar": 3,
@@ -310,30 +368,33 @@ MONTHS = {
     "october": 10, "oct": 10, "november": 11, "nov": 11, "december": 12, "dec": 12
 }
 
-def wants_distinct(tokens): return any(w in DISTINCT_WORDS for w in tokens)
-def tokens_contain(tokens, words): return any(w in set(tokens) for w in words)
+# Both take tset = frozenset(tokens), built once per question
+def wants_distinct(tset): return not tset.isdisjoint(DISTINCT_WORDS)
+def tokens_contain(tset, words): return not tset.isdisjoint(words)
 
 def extract_top_n(tokens):
-    q = " ".join(tokens)
-    m = TOP_N_RE.search(q)
-    return int(m.group(2)) if m else None
+    # "top 5" / "best 10": a keyword token directly followed by a number token
+    for i, t in enumerate(tokens[:-1]):
+        if t in ("top", "best") and tokens[i + 1].isdigit():
+            return int(tokens[i + 1])
+    return None
 
-def extract_time_bucket(tokens, text):
+def extract_time_bucket(tset, text):
     t = text.lower()
-    if any(p in t for p in ["quarterly", "by quarter", "qtr"]) or re.search(r"\bq[1-4]\b", t) or "quarter" in tokens:
+    if any(p in t for p in ["quarterly", "by quarter", "qtr"]) or Q_TOKEN_RE.search(t) or "quarter" in tset:
         return "quarter"
-    if any(p in t for p in ["by month", "monthly", "per month", "each month", "months"]) or "month" in tokens:
+    if any(p in t for p in ["by month", "monthly", "per month", "each month", "months"]) or "month" in tset:
         return "month"
-    if any(p in t for p in ["yearly", "per year", "by year", "years"]) or "year" in tokens or "yearly" in tokens:
+    if any(p in t for p in ["yearly", "per year", "by year", "years"]) or "year" in tset or "yearly" in tset:
         return "year"
-    if "day" in tokens:
+    if "day" in tset:
         return "day"
     return None
 
-def period_expressions(bucket: str, date_col: str = "orders.order_date"):
+def _build_period_expressions(bucket, dialect, date_col):
     if not bucket:
         return None, None, None, None
-    if db_type == "SQLite":
+    if dialect == "SQLite":
         d = date_col
         if bucket == "day":
             label = f"strftime('%Y-%m-%d', {d})"; return label, label, label, "period"
@@ -369,20 +430,56 @@ def period_expressions(bucket: str, date_col: str = "orders.order_date"):
             grp = f"date_trunc('quarter', {date_col}::timestamp)"; return label, grp, grp, "period"
     return None, None, None, None
 
+# Every generated query buckets on orders.order_date, so the fragments for both
+# dialects are built once at import; other date columns go through the builder.
+PERIOD_DATE_COL = "orders.order_date"
+_PERIOD_BUCKETS = ("day", "month", "year", "quarter")
+_PERIOD_SQLITE = {b: _build_period_expressions(b, "SQLite", PERIOD_DATE_COL) for b in _PERIOD_BUCKETS}
+_PERIOD_PG = {b: _build_period_expressions(b, "PostgreSQL", PERIOD_DATE_COL) for b in _PERIOD_BUCKETS}
+_NO_PERIOD = (None, None, None, None)
+
+def period_expressions(bucket: str, date_col: str = PERIOD_DATE_COL):
+    if date_col != PERIOD_DATE_COL:
+        return _build_period_expressions(bucket, db_type, date_col)
+    table = _PERIOD_SQLITE if db_type == "SQLite" else _PERIOD_PG
+    return table.get(bucket, _NO_PERIOD)
+
 def sql_placeholders():
     return "%s" if db_type == "PostgreSQL" else "?"
 
-def base_joins():
+def _join_block(orders_src):
     return (
         "FROM order_items\n"
-        "JOIN orders   ON order_items.order_id = orders.order_id\n"
+        f"JOIN {orders_src} ON order_items.order_id = orders.order_id\n"
         "LEFT JOIN products  ON order_items.product_id = products.product_id\n"
         "LEFT JOIN customers ON orders.customer_id = customers.customer_id\n"
     )
 
+BASE_JOINS = _join_block("orders  ")
+# The date-filtered CTE `o` stands in for orders (aliased back to `orders` so
+# every other expression stays unchanged)
+BASE_JOINS_FILTERED = _join_block("o AS orders")
+
+def base_joins(filtered_orders: bool = False):
+    return BASE_JOINS_FILTERED if filtered_orders else BASE_JOINS
+
 # ======== Natural-language period filters (year, month-year, quarter-year) ========
 YEAR_RE = re.compile(r"\b(20\d{2})\b")
-MONTH_YEAR_RE = re.compile(r"\b(" + "|".join(MONTHS.keys()) + r")\s+(20\d{2})\b", re.IGNORECASE)
+# Any word followed by a year; the month itself is resolved via MONTHS lookup
+_WORD_YEAR_RE = re.compile(r"\b([a-z]+)\s+(20\d{2})\b")
+_QY_RE = re.compile(r"\b(20\d{2})\s*q([1-4])\b")
+_YQ_RE = re.compile(r"\bq([1-4])\s*(20\d{2})\b")
+_ORDINAL_Q_RE = re.compile(r"\b(first|second|third|fourth)\s+quarter(?:\s+of|\s+in)?\s+(20\d{2})\b")
+_ORDERS_COUNT_RE = re.compile(r"\border(s)?\s+count\b|\bcount of orders\b|\bnumber of orders\b|\border volume\b")
+_DATE_BETWEEN_RE = re.compile(r"date\s+between\s+(\d{4}-\d{2}-\d{2})\s+and\s+(\d{4}-\d{2}-\d{2})")
+_WHERE_TAIL_RE = re.compile(r"([a-zA-Z_\.]+)\s*(=|>|<)\s*'?(.*?)'?$")
+
+_DAYS_IN_MONTH = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+def _last_day(y, m):
+    if m == 2 and (y % 4 == 0 and (y % 100 != 0 or y % 400 == 0)):
+        return 29
+    return _DAYS_IN_MONTH[m - 1]
 
 def _year_condition():
     if db_type == "SQLite":
@@ -404,35 +501,37 @@ def extract_period_filters(text: str):
     single_year = None
 
     # Month + Year (e.g., "January 2025")
-    m = MONTH_YEAR_RE.search(t)
-    if m:
-        mon_name, yr = m.group(1).lower(), int(m.group(2))
-        mon = MONTHS[mon_name]
-        last_day = calendar.monthrange(yr, mon)[1]
+    for m in _WORD_YEAR_RE.finditer(t):
+        mon = MONTHS.get(m.group(1))
+        if not mon:
+            continue
+        yr = int(m.group(2))
+        last_day = _last_day(yr, mon)
         start = f"{yr:04d}-{mon:02d}-01"
         end = f"{yr:04d}-{mon:02d}-{last_day:02d}"
         where_parts.append(_between_condition())
         params.extend([start, end])
         inferred_bucket = inferred_bucket or "day"
         single_year = yr
+        break
 
     # Quarter + Year
     q = None; yr = None
-    qmatch = re.search(r"\b(20\d{2})\s*q([1-4])\b", t) or re.search(r"\bq([1-4])\s*(20\d{2})\b", t)
+    qmatch = _QY_RE.search(t) or _YQ_RE.search(t)
     if qmatch:
         if qmatch.group(1).startswith("20") and qmatch.group(2):
             yr, q = int(qmatch.group(1)), int(qmatch.group(2))
         else:
             q, yr = int(qmatch.group(1)), int(qmatch.group(2))
     else:
-        ordinal = re.search(r"\b(first|second|third|fourth)\s+quarter(?:\s+of|\s+in)?\s+(20\d{2})\b", t)
+        ordinal = _ORDINAL_Q_RE.search(t)
         if ordinal:
             qwords = {"first":1,"second":2,"third":3,"fourth":4}
             q, yr = qwords[ordinal.group(1)], int(ordinal.group(2))
     if q and yr:
         start_mon = 1 + (q - 1) * 3
         end_mon = start_mon + 2
-        last_day = calendar.monthrange(yr, end_mon)[1]
+        last_day = _last_day(yr, end_mon)
         start = f"{yr:04d}-{start_mon:02d}-01"
         end = f"{yr:04d}-{end_mon:02d}-{last_day:02d}"
         where_parts.append(_between_condition())
@@ -456,64 +555,16 @@ def extract_period_filters(text: str):
 # ========= English â†’ SQL =========
 def detect_orders_count(text: str) -> bool:
     t = text.lower()
-    return bool(
-        re.search(r"\border(s)?\s+count\b", t) or
-        re.search(r"\bcount of orders\b", t) or
-        re.search(r"\bnumber of orders\b", t) or
-        re.search(r"\border volume\b", t)
-    )
+    return bool(_ORDERS_COUNT_RE.search(t))
 
-def build_join_sql(question_text, tokens, agg, where_clause):
-    # Measure selection
-    if detect_orders_count(question_text):
-        select_measure = "COUNT(DISTINCT orders.order_id) AS value"
-    else:
-        is_distinct = wants_distinct(tokens)
-        measure = "line_total"
-        select_measure = (
-            "COUNT(DISTINCT customers.customer_id) AS value"
-            if is_distinct and tokens_contain(tokens, ["customer"])
-            else f"{agg}({measure}) AS value"
-        )
-
-    # Detect bucket & period filters
-    bucket = extract_time_bucket(tokens, question_text)
-    period_parts, period_params, inferred_bucket, single_year = extract_period_filters(question_text)
-    if not bucket and inferred_bucket:
-        bucket = inferred_bucket
-
-    lbl, grp, ordk, alias = period_expressions(bucket)
-
-    # "date between â€¦ and â€¦"
-    m = re.search(r"date\s+between\s+(\d{4}-\d{2}-\d{2})\s+and\s+(\d{4}-\d{2}-\d{2})", question_text.lower())
-    extra_between = None
-    params = []
-    if m:
-        dt1, dt2 = m.group(1), m.group(2)
-        extra_between = _between_condition()
-        params.extend([dt1, dt2])
-
-    # WHERE
-    parts = []
-    if where_clause:
-        parts.append(where_clause.replace("WHERE", "").strip())
-    parts.extend(period_parts)
-    if extra_between:
-        parts.append(extra_between)
-    final_where = ("WHERE " + " AND ".join(parts) + "\n") if parts else ""
-
-    top_n = extract_top_n(tokens)
-    limit_clause = f"\nLIMIT {top_n}" if top_n else ""
-
-    # ---- Calendar fill helpers (time-only, single year) ----
-    def with_calendar_fill_time_only():
-        joins = base_joins()
-        all_params = period_params + params
-        if db_type == "SQLite":
-            if bucket == "quarter":
-                cal_rows = ", ".join([f"('{single_year}-Q{i}', {i})" for i in range(1,5)])
-                sql = f"""
-WITH cal(period, ord) AS (VALUES {cal_rows}),
+# ---- Calendar fill helpers (time-only, single year) ----
+def with_calendar_fill_time_only(lbl, grp, bucket, single_year, select_measure,
+                                 joins, final_where, with_head):
+    if db_type == "SQLite":
+        if bucket == "quarter":
+            cal_rows = ", ".join([f"('{single_year}-Q{i}', {i})" for i in range(1,5)])
+            sql = f"""
+{with_head}cal(period, ord) AS (VALUES {cal_rows}),
 agg AS (
   SELECT {lbl} AS period, {select_measure}
   {joins}{final_where}
@@ -524,11 +575,11 @@ FROM cal
 LEFT JOIN agg ON agg.period = cal.period
 ORDER BY cal.ord;
 """.strip()
-                return sql, all_params
-            if bucket == "month":
-                cal_rows = ", ".join([f"('{single_year}-{m:02d}', {m})" for m in range(1,13)])
-                sql = f"""
-WITH cal(period, ord) AS (VALUES {cal_rows}),
+            return sql
+        if bucket == "month":
+            cal_rows = ", ".join([f"('{single_year}-{m:02d}', {m})" for m in range(1,13)])
+            sql = f"""
+{with_head}cal(period, ord) AS (VALUES {cal_rows}),
 agg AS (
   SELECT {lbl} AS period, {select_measure}
   {joins}{final_where}
@@ -539,10 +590,10 @@ FROM cal
 LEFT JOIN agg ON agg.period = cal.period
 ORDER BY cal.ord;
 """.strip()
-                return sql, all_params
-            if bucket == "year":
-                sql = f"""
-WITH cal(period, ord) AS (VALUES ('{single_year}', 1)),
+            return sql
+        if bucket == "year":
+            sql = f"""
+{with_head}cal(period, ord) AS (VALUES ('{single_year}', 1)),
 agg AS (
   SELECT {lbl} AS period, {select_measure}
   {joins}{final_where}
@@ -553,12 +604,12 @@ FROM cal
 LEFT JOIN agg ON agg.period = cal.period
 ORDER BY cal.ord;
 """.strip()
-                return sql, all_params
-        else:
-            # PostgreSQL
-            if bucket == "quarter":
-                sql = f"""
-WITH cal AS (
+            return sql
+    else:
+        # PostgreSQL
+        if bucket == "quarter":
+            sql = f"""
+{with_head}cal AS (
   SELECT q AS ord, to_char(make_date({single_year}, 1 + (q-1)*3, 1), 'YYYY-"Q"Q') AS period
   FROM generate_series(1,4) AS q
 ),
@@ -572,10 +623,10 @@ FROM cal
 LEFT JOIN agg ON agg.period = cal.period
 ORDER BY cal.ord;
 """.strip()
-                return sql, all_params
-            if bucket == "month":
-                sql = f"""
-WITH cal AS (
+            return sql
+        if bucket == "month":
+            sql = f"""
+{with_head}cal AS (
   SELECT to_char(d, 'YYYY-MM') AS period, EXTRACT(MONTH FROM d)::int AS ord
   FROM generate_series(date '{single_year}-01-01', date '{single_year}-12-01', interval '1 month') AS d
 ),
@@ -589,10 +640,10 @@ FROM cal
 LEFT JOIN agg ON agg.period = cal.period
 ORDER BY cal.ord;
 """.strip()
-                return sql, all_params
-            if bucket == "year":
-                sql = f"""
-WITH cal(period, ord) AS (VALUES ('{single_year}', 1)),
+            return sql
+        if bucket == "year":
+            sql = f"""
+{with_head}cal(period, ord) AS (VALUES ('{single_year}', 1)),
 agg AS (
   SELECT {lbl} AS period, {select_measure}
   {joins}{final_where}
@@ -603,99 +654,238 @@ FROM cal
 LEFT JOIN agg ON agg.period = cal.period
 ORDER BY cal.ord;
 """.strip()
-                return sql, all_params
-        return None, all_params
-
-    def dim_block(dim, group_cols, include_period=False):
-        joins = base_joins()
-        all_params = period_params + params
-        if include_period and lbl and grp:
-            sql = f"SELECT {dim}, {lbl} AS {alias}, {select_measure}\n{joins}"
-            if final_where: sql += final_where
-            sql += f"GROUP BY {group_cols}, {grp}\n"
-            sql += f"ORDER BY {group_cols}, {ordk}\n" if ordk else "ORDER BY 3 DESC\n"
-            sql += f"{limit_clause};"
-            return sql, all_params
-        else:
-            sql = f"SELECT {dim}, {select_measure}\n{joins}"
-            if final_where: sql += final_where
-            sql += f"GROUP BY {group_cols}\nORDER BY 2 DESC{limit_clause};"
-            return sql, all_params
+            return sql
+    return None
+
+def dim_block(dim, group_cols, period, select_measure, with_prefix, from_where, limit_clause):
+    # period is (lbl, grp, ordk, alias) for a per-period breakdown, else None;
+    # from_where is the join block followed by the (possibly empty) WHERE line
+    if period:
+        lbl, grp, ordk, alias = period
+        sql = f"{with_prefix}SELECT {dim}, {lbl} AS {alias}, {select_measure}\n{from_where}"
+        sql += f"GROUP BY {group_cols}, {grp}\n"
+        sql += f"ORDER BY {group_cols}, {ordk}\n" if ordk else "ORDER BY 3 DESC\n"
+        sql += f"{limit_clause};"
+        return sql
+    else:
+        sql = f"{with_prefix}SELECT {dim}, {select_measure}\n{from_where}"
+        sql += f"GROUP BY {group_cols}\nORDER BY 2 DESC{limit_clause};"
+        return sql
+
+
+# Max buckets per year: row count of a calendar-filled series, and an upper bound
+# for any time-only series restricted to a single year
+PERIODS_PER_YEAR = {"day": 366, "month": 12, "quarter": 4, "year": 1}
+
+def _time_only_row_bound(bucket, single_year, between, top_n):
+    bounds = [top_n] if top_n else []
+    if single_year:
+        bounds.append(PERIODS_PER_YEAR[bucket])
+    if between and bucket == "day":
+        try:
+            bounds.append((date.fromisoformat(between[1]) - date.fromisoformat(between[0])).days + 1)
+        except ValueError:
+            pass
+    return max(min(bounds), 0) if bounds else None
+
+def build_join_sql(question_text, tokens, agg, where_clause, tset=None):
+    """Returns (sql, params, row_bound); row_bound is the max row count when known, else None."""
+    if tset is None:
+        tset = frozenset(tokens)
+    # Measure selection
+    if detect_orders_count(question_text):
+        select_measure = "COUNT(DISTINCT orders.order_id) AS value"
+    else:
+        is_distinct = wants_distinct(tset)
+        measure = "line_total"
+        select_measure = (
+            "COUNT(DISTINCT customers.customer_id) AS value"
+            if is_distinct and "customer" in tset
+            else f"{agg}({measure}) AS value"
+        )
+
+    # Detect bucket & period filters
+    bucket = extract_time_bucket(tset, question_text)
+    period_parts, period_params, inferred_bucket, single_year = extract_period_filters(question_text)
+    if not bucket and inferred_bucket:
+        bucket = inferred_bucket
+
+    lbl, grp, ordk, alias = period_expressions(bucket)
+
+    # "date between â€¦ and â€¦"
+    m = _DATE_BETWEEN_RE.search(question_text.lower())
+    extra_between = None
+    params = []
+    if m:
+        dt1, dt2 = m.group(1), m.group(2)
+        extra_between = _between_condition()
+        params.extend([dt1, dt2])
+
+    # WHERE: date predicates are pushed down into a CTE over orders so the date
+    # range is applied before the star join; anything else stays in the outer WHERE.
+    # Only the date predicates carry placeholders, so param order is unchanged.
+    date_parts = list(period_parts)
+    if extra_between:
+        date_parts.append(extra_between)
+    parts = []
+    if where_clause:
+        parts.append(where_clause.replace("WHERE", "").strip())
+    final_where = ("WHERE " + " AND ".join(parts) + "\n") if parts else ""
+
+    if date_parts:
+        orders_cte = "o AS (SELECT * FROM orders WHERE " + " AND ".join(date_parts) + ")"
+        with_prefix = f"WITH {orders_cte}\n"   # plain queries
+        with_head = f"WITH {orders_cte},\n"    # queries that add their own CTEs
+    else:
+        with_prefix = ""
+        with_head = "WITH "
+
+    top_n = extract_top_n(tokens)
+    limit_clause = f"\nLIMIT {top_n}" if top_n else ""
+
+    joins = base_joins(bool(date_parts))
+    all_params = period_params + params
 
     # Dimensions
-    if tokens_contain(tokens, ["customer", "customers"]):
-        return dim_block("customers.customer_name AS dimension", "customers.customer_name", include_period=bool(lbl))
-    if tokens_contain(tokens, ["product", "products"]):
-        return dim_block("products.product_name AS dimension", "products.product_name", include_period=bool(lbl))
-    if tokens_contain(tokens, ["category", "categories"]):
-        return dim_block("products.category AS dimension", "products.category", include_period=bool(lbl))
+    period = (lbl, grp, ordk, alias) if lbl and grp else None
+    dim = None
+    if tokens_contain(tset, _CUSTOMER_WORDS):
+        dim = ("customers.customer_name AS dimension", "customers.customer_name")
+    elif tokens_contain(tset, _PRODUCT_WORDS):
+        dim = ("products.product_name AS dimension", "products.product_name")
+    elif tokens_contain(tset, _CATEGORY_WORDS):
+        dim = ("products.category AS dimension", "products.category")
+    if dim:
+        sql = dim_block(*dim, period, select_measure, with_prefix, joins + final_where, limit_clause)
+        return sql, all_params, top_n
 
     # Time-only
     if lbl and grp:
         if single_year and (bucket in ("month", "quarter", "year")):
-            sql_fill, all_params = with_calendar_fill_time_only()
+            sql_fill = with_calendar_fill_time_only(
+                lbl, grp, bucket, single_year, select_measure,
+                joins, final_where, with_head,
+            )
             if sql_fill:
-                return sql_fill, all_params
+                return sql_fill, all_params, PERIODS_PER_YEAR[bucket]
 
-        joins = base_joins()
-        sql = f"SELECT {lbl} AS {alias}, {select_measure}\n{joins}"
+        sql = f"{with_prefix}SELECT {lbl} AS {alias}, {select_measure}\n{joins}"
         if final_where: sql += final_where
         sql += f"GROUP BY {grp}\n"
         sql += f"ORDER BY {ordk}\n" if ordk else "ORDER BY 2 DESC\n"
         sql += f"{limit_clause};"
-        return (sql, period_params + params)
+        return (sql, all_params, _time_only_row_bound(bucket, single_year, params, top_n))
 
     # Default total
-    joins = base_joins()
-    sql = f"SELECT {select_measure}\n{joins}"
+    sql = f"{with_prefix}SELECT {select_measure}\n{joins}"
     if final_where: sql += final_where
     sql += "LIMIT 1;"
-    return sql, period_params + params
+    return sql, all_params, 1
 
 
-def translate_question_to_sql(question, schema):
+# Translation only depends on the question text and the SQL dialect, so identical
+# (e.g. sample) questions are served from the cache. lru_cache would be rebuilt on
+# every Streamlit rerun; st.cache_data survives them.
+@st.cache_data(max_entries=256, show_spinner=False)
+def _translate_cached(question, dialect):
     tokens, _ = tokenize_and_tag(question)
+    tset = frozenset(tokens)
     agg = next((AGG_KEYWORDS[t] for t in tokens if t in AGG_KEYWORDS), "SUM")
 
     where_clause = ""
     if " where " in (" " + question.lower() + " "):
         tail = question.lower().split("where", 1)[1].strip()
-        m = re.match(r"([a-zA-Z_\.]+)\s*(=|>|<)\s*'?(.*?)'?$", tail)
+        m = _WHERE_TAIL_RE.match(tail)
         if m:
             col, op, val = m.groups()
             where_clause = f"WHERE {col} {op} '{val}'"
 
-    sql, params = build_join_sql(question, tokens, agg, where_clause)
-    return sql, params, None if sql else ("", [], "Couldn't translate question.")
+    sql, params, row_bound = build_join_sql(question, tokens, agg, where_clause, tset)
+    return sql, tuple(params), None if sql else ("", [], "Couldn't translate question."), row_bound
+
+
+def translate_question_to_sql(question, schema):
+    """Returns (sql, params, err, row_bound); row_bound feeds run_query's fetch strategy."""
+    sql, params, err, row_bound = _translate_cached(question, db_type)
+    return sql, list(params), err, row_bound
+
+
+# Results without a known small row bound are fetched in batches of ROW_BATCH rows
+ROW_BATCH = 5000
+SINGLE_SHOT_LIMIT = 1000
+
+def _records_to_df(rows, cols):
+    # coerce_float turns Postgres NUMERIC (Decimal) aggregates into floats, as read_sql_query did
+    return pd.DataFrame.from_records(rows, columns=cols, coerce_float=True)
+
+def run_query(conn, sql, params, row_bound=None):
+    """Execute on a plain DB-API cursor and build the DataFrame directly from the rows."""
+    small = row_bound is not None and row_bound <= SINGLE_SHOT_LIMIT
+    if db_type == "PostgreSQL" and not small:
+        # Server-side cursor: each fetchmany below pulls ROW_BATCH rows per round trip.
+        # Unique name because the connection is shared across sessions; withhold=True
+        # because named cursors need it outside a transaction (autocommit).
+        cur = conn.cursor(name=f"e2s_{uuid4().hex}", withhold=True)
+    else:
+        cur = conn.cursor()
+    try:
+        cur.execute(sql, params)
+        if small:
+            rows = cur.fetchall()
+            return _records_to_df(rows, [d[0] for d in cur.description])
+
+        frames = []
+        rows = cur.fetchmany(ROW_BATCH)
+        cols = [d[0] for d in cur.description]  # named PG cursors only know this after a fetch
+        while rows:
+            frames.append(_records_to_df(rows, cols))
+            rows = cur.fetchmany(ROW_BATCH)
+    finally:
+        cur.close()
+    if not frames:
+        return _records_to_df([], cols)
+    return pd.concat(frames, ignore_index=True, copy=False) if len(frames) > 1 else frames[0]
+
+
+# ========= Sample questions =========
+SAMPLE_QUESTIONS = [
+    # time-only totals
+    "total sales by month in 2023",
+    "orders count by month in 2024",
+    "total sales by quarter in 2025",
+    "yearly revenue",
+
+    # month / quarter specific
+    "sales in January 2025",
+    "orders count in January 2025",
+    "sales in Q4 2025",
+    "sales in Q4 2025 by category",
+
+    # time + dimension + top-N
+    "top 5 customers by total sales",
+    "top 5 products by total sales in 2024",
+
+    # explicit date between window (daily)
+    "total sales by day where date between 2025-10-20 and 2025-10-25",
+
+    # time + dimension breakdowns
+    "monthly revenue in 2025 by product",
+    "yearly revenue by category",
+]
+
+
+# Pre-translate the sample buttons once per dialect so the first click is a cache hit
+@st.cache_resource(show_spinner=False)
+def _warm_sample_translations(dialect):
+    for q in SAMPLE_QUESTIONS:
+        _translate_cached(q, dialect)
+    return True
+
+_warm_sample_translations(db_type)
 
 
 # ========= UI: Ask + Run =========
 if st.session_state.get("schema"):
-    SAMPLE_QUESTIONS = [
-        # time-only totals
-        "total sales by month in 2023",
-        "orders count by month in 2024",
-        "total sales by quarter in 2025",
-        "yearly revenue",
-
-        # month / quarter specific
-        "sales in January 2025",
-        "orders count in January 2025",
-        "sales in Q4 2025",
-        "sales in Q4 2025 by category",
-
-        # time + dimension + top-N
-        "top 5 customers by total sales",
-        "top 5 products by total sales in 2024",
-
-        # explicit date between window (daily)
-        "total sales by day where date between 2025-10-20 and 2025-10-25",
-
-        # time + dimension breakdowns
-        "monthly revenue in 2025 by product",
-        "yearly revenue by category",
-    ]
-
     st.subheader("💡Sample Questions")
     cols = st.columns(3)
     for i, q in enumerate(SAMPLE_QUESTIONS):
@@ -711,18 +901,14 @@ if st.session_state.get("schema"):
         if not st.session_state.get("conn"):
             st.warning("Please connect and scan schema first.")
         else:
-            sql, params, err = translate_question_to_sql(question, st.session_state["schema"])
+            sql, params, err, row_bound = translate_question_to_sql(question, st.session_state["schema"])
             if err:
                 st.error(err)
             else:
                 st.code(sql, language="sql")
                 try:
-                    if db_type == "SQLite":
-                        with sqlite3.connect(sqlite_path, check_same_thread=False) as _conn:
-                            df = pd.read_sql_query(sql, _conn, params=params)
-                    else:
-                        # Postgres path (requires psycopg2 + a live connection)
-                        df = pd.read_sql_query(sql, st.session_state["conn"], params=params)
+                    # Reuse the cached connection opened by "Connect & Scan Schema"
+                    df = run_query(st.session_state["conn"], sql, params, row_bound)
 
                     st.subheader("📊 Results")
                     st.dataframe(df, use_container_width=True)
@@ -736,26 +922,9 @@ if st.session_state.get("schema"):
 
                         cols_df = list(df.columns)
 
-                        # Time series sorting for nice charts
+                        # Time series: rows already come back in period order
+                        # (ORDER BY ordk / cal.ord in the generated SQL)
                         if "period" in cols_df and "value" in cols_df:
-                            def sort_key(val: str):
-                                val = str(val)
-                                m = re.match(r"^(\d{4})-(\d{2})$", val)
-                                if m:
-                                    yr = int(m.group(1)); mo = int(m.group(2))
-                                    return (yr, mo, 0)
-                                q = re.match(r"^(\d{4})-Q([1-4])$", val, re.IGNORECASE)
-                                if q:
-                                    yr = int(q.group(1)); qq = int(q.group(2))
-                                    return (yr, qq * 3, 1)
-                                y = re.match(r"^(\d{4})$", val)
-                                if y:
-                                    yr = int(y.group(1))
-                                    return (yr, 0, 2)
-                                return (9999, 99, 9)
-
-                            df = df.sort_values(by="period", key=lambda col: col.map(sort_key))
-
                             if "dimension" in cols_df:
                                 try:
                                     pv = df.pivot(index="period", columns="dimension", values="value")
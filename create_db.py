@@ -5,8 +5,14 @@ p = pathlib.Path(db)
 # Python 3.8+ supports missing_ok
 p.unlink(missing_ok=True)
 
+# Fast bulk load: no journal/fsync while seeding, one transaction for the whole script
+FAST_LOAD = "PRAGMA journal_mode=OFF; PRAGMA synchronous=OFF; PRAGMA temp_store=MEMORY; PRAGMA locking_mode=EXCLUSIVE; PRAGMA foreign_keys=ON;"
+RESTORE = "PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;"
+
 with sqlite3.connect(db) as con:
+    con.executescript(FAST_LOAD)
     with open('seed_sqlite.sql', 'r', encoding='utf-8') as f:
-        con.executescript(f.read())
+        con.executescript("BEGIN;\n" + f.read() + "\nCOMMIT;")
+    con.executescript(RESTORE)
 
 print(r"Created retail_demo.sqlite successfully in C:\streamlit\english_to_sql")
@@ -41,6 +41,9 @@ CREATE TABLE order_items (
 );
 
 CREATE INDEX idx_orders_order_date ON orders(order_date);
+CREATE INDEX ix_oi_order ON order_items(order_id);
+CREATE INDEX ix_oi_product ON order_items(product_id);
+CREATE INDEX ix_orders_customer ON orders(customer_id);
 
 -- Dimensions
 INSERT INTO customers (customer_id, customer_name) VALUES
@@ -128,6 +131,9 @@ FROM orders o
 WHERE o.order_date BETWEEN '2023-01-01' AND '2025-12-31'
   AND (SELECT COUNT(*) FROM order_items x WHERE x.order_id = o.order_id) = 1;
 
+-- Refresh planner statistics for the indexes above
+ANALYZE;
+
 -- Sanity checks (uncomment to test in sqlite shell)
 -- SELECT MIN(order_date), MAX(order_date) FROM orders;
 -- SELECT strftime('%Y', order_date) AS y, COUNT(*) AS days FROM orders GROUP BY y;